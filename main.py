@@ -1,6 +1,8 @@
 # main.py — Upbit Bottom-Entry Bot (percent_base 50% entry + Reserved Pool + SafeOrders + Exact PnL + Trail Alerts)
 # 2025-08 final
 # - 스캐너: TOPN 상위 유니버스 + 바닥반등(완화) 조건
+#   SCAN_ALIGN=candle → 1분봉 마감 +SCAN_CLOSE_OFFSET_SEC에 맞춰 스캔, 마감된 봉만 평가
+#   2단계 후보 파이프라인: 티커 스냅샷 프리필터(무료) → 생존 종목만 OHLCV/지표 평가
 # - 예산:
 #   [기본] ENTRY_MODE=percent_base → 관측된 "현금 최대치"를 기준예산으로 삼아 항상 기준예산의 ENTRY_RATIO(기본 50%)만큼 진입
 #         (돈을 더 넣으면 다음부터 자동으로 진입금액이 커짐 / 남은 현금 기준으로 줄어드는 문제 방지)
@@ -11,12 +13,21 @@
 # - 체결가 기반 PnL: 매수/매도 모두 실체결가로 손익 계산/CSV 기록
 # - 트레일링: 활성화 알림 1회 보장, highest 선 지속 갱신
 # - Dust: 평가금액 < DUST_LIMIT_KRW는 청소/숨김
-# - 09:00:15 KST 일일 리포트 + Dust 청소
+# - 09:00 KST 일일 리포트(잔고 1회+시세 배치 1회 스냅샷 선행) → 발송 후 Dust 병렬 청소
+# - 전략 플러그인: STRATEGIES(JSON)로 여러 전략 병행, 캔들/지표/시세 캐시 공유, 전략별 슬롯/예산/시간예산
+# - 리스크: 진입 시 보유/후보 수익률 행렬로 변동성 스케일·상관 패널티·포트폴리오 σ 상한 적용
+# - 섀도 모드: SHADOW_PROFILES 대체 파라미터를 같은 데이터로 가상 운용, 일일 리포트에서 라이브와 비교
 # - Render/Gunicorn 호환: import-time autostart
-
-import os, time, json, csv, math, random, requests, threading, traceback, uuid, jwt, pyupbit
+# - 진단: /debug/timings 단계별 타이밍 링버퍼, /debug/profile/* 온디맨드 샘플링 프로파일러(DEBUG_TOKEN 필요)
+# - 주문 트레이스: 결정→제출→응답→체결 시각/재시도/슬리피지를 trades.csv에 기록, /debug/latency 요약
+
+import os, sys, time, json, csv, math, random, requests, threading, traceback, uuid, jwt, pyupbit
+import numpy as np
+from collections import deque, Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 from datetime import datetime, timedelta, timezone
-from flask import Flask, jsonify
+from flask import Flask, jsonify, request
 
 # ===================== Flask =====================
 app = Flask(__name__)
@@ -33,7 +44,7 @@ def health():
 def portfolio():
     with POS_LOCK:
         snap = {t: POS[t].copy() for t in POS}
-    prices = {t: get_price_safe(t) for t in snap}
+    prices = {t: get_quote(t) for t in snap}
     return jsonify({"ok": True, "positions": snap, "prices": prices}), 200
 
 @app.get("/reconcile")
@@ -59,6 +70,61 @@ def reconcile():
     except Exception as e:
         return {"ok": False, "err": str(e)}, 500
 
+def _debug_authed():
+    # 프로파일러는 DEBUG_TOKEN 설정 시에만 사용 가능 (헤더 X-Debug-Token 또는 ?token=)
+    tok = request.headers.get("X-Debug-Token") or request.args.get("token", "")
+    return bool(DEBUG_TOKEN) and tok == DEBUG_TOKEN
+
+def _num_arg(name, default):
+    # 숫자가 아니거나 inf/nan → None (호출부에서 400)
+    try: v = float(request.args.get(name, default))
+    except (TypeError, ValueError): return None
+    return v if math.isfinite(v) else None
+
+@app.get("/debug/timings")
+def debug_timings():
+    n = _num_arg("n", "20")
+    if n is None: return jsonify({"ok": False, "err": "bad n"}), 400
+    n = max(1, min(TIMING_RING, int(n)))
+    out = {}
+    for kind, ring in TIMINGS.items():
+        cycles = list(ring)
+        out[kind] = {"cycles": len(cycles), "summary": _timing_summary(cycles),
+                     "recent": [c.as_dict() for c in cycles[-n:]]}
+    return jsonify({"ok": True, "enabled": TIMING_ENABLED, "timings": out, "sched": dict(SCHED),
+                    "backoff": dict(BACKOFF)}), 200
+
+@app.get("/debug/profile/start")
+def debug_profile_start():
+    if not _debug_authed(): return jsonify({"ok": False, "err": "forbidden"}), 403
+    seconds = _num_arg("seconds", "30"); hz = _num_arg("hz", "50")
+    if seconds is None or hz is None:
+        return jsonify({"ok": False, "err": "bad seconds/hz"}), 400
+    seconds = max(1.0, min(PROFILE_MAX_SEC, seconds))
+    hz = max(1.0, min(PROFILE_MAX_HZ, hz))
+    if not PROFILER.start(seconds, 1.0/hz):
+        return jsonify({"ok": False, "err": "already running"}), 409
+    return jsonify({"ok": True, "seconds": seconds, "hz": hz}), 200
+
+@app.get("/debug/profile/stop")
+def debug_profile_stop():
+    if not _debug_authed(): return jsonify({"ok": False, "err": "forbidden"}), 403
+    PROFILER.stop()
+    return PROFILER.collapsed(), 200, {"Content-Type": "text/plain; charset=utf-8"}
+
+@app.get("/debug/profile")
+def debug_profile():
+    if not _debug_authed(): return jsonify({"ok": False, "err": "forbidden"}), 403
+    if PROFILER.running():
+        return jsonify({"ok": True, "running": True, "samples": PROFILER.samples}), 200
+    return PROFILER.collapsed(), 200, {"Content-Type": "text/plain; charset=utf-8"}
+
+@app.get("/debug/latency")
+def debug_latency():
+    since = request.args.get("since", "")  # YYYY-MM-DD (KST)
+    rows = [r for r in _read_csv() if r.get("t_decision") and r.get("ts","") >= since]
+    return jsonify({"ok": True, "labels": _latency_summary(rows)}), 200
+
 # ===================== ENV =====================
 ACCESS_KEY       = os.getenv("ACCESS_KEY")
 SECRET_KEY       = os.getenv("SECRET_KEY")
@@ -79,8 +145,16 @@ BASE_BUDGET_KRW        = float(os.getenv("BASE_BUDGET_KRW", "0"))         # fixe
 
 # 스캐너
 SCAN_INTERVAL_SEC      = int(os.getenv("SCAN_INTERVAL_SEC", "45"))
+SCAN_ALIGN             = os.getenv("SCAN_ALIGN", "candle").lower()       # candle | fixed
+SCAN_CLOSE_OFFSET_SEC  = float(os.getenv("SCAN_CLOSE_OFFSET_SEC", "2.0"))  # 1분봉 마감 후 지연
 TOPN_INITIAL           = int(os.getenv("TOPN_INITIAL", "25"))
 MIN_PRICE_KRW          = float(os.getenv("MIN_PRICE_KRW", "100"))
+PREFILTER_POOL_MULT    = int(os.getenv("PREFILTER_POOL_MULT", "3"))         # 스냅샷 단계 풀 = TOPN×배수
+PREFILTER_MAX_RANGE_POS= float(os.getenv("PREFILTER_MAX_RANGE_POS", "1.0"))  # 일중 범위 내 위치 상한(0=저가,1=고가), 1.0=끔
+PREFILTER_MAX_CHG_PCT  = float(os.getenv("PREFILTER_MAX_CHG_PCT", "inf"))    # 전일대비 급등 제외, inf=끔
+CANDLE_TTL_SEC         = int(os.getenv("CANDLE_TTL_SEC", "15"))            # fixed 모드 캔들 캐시 수명
+STRATEGIES_CONF        = os.getenv("STRATEGIES", "").strip()               # 전략 목록(JSON), 비우면 기본 1개
+STRATEGY_TIME_BUDGET_MS= float(os.getenv("STRATEGY_TIME_BUDGET_MS", "200"))  # 전략별 스캔 1회당 진입평가 시간 상한
 EXCLUDED_TICKERS       = set([t.strip() for t in os.getenv("EXCLUDED_TICKERS","KRW-BTC,KRW-ETH").split(",") if t.strip()])
 
 # 바닥 진입(완화 프리셋)
@@ -90,6 +164,15 @@ REBOUND_FROM_LOW_PCT   = float(os.getenv("REBOUND_FROM_LOW_PCT", "0.5"))
 VOL_BOOST_MULT         = float(os.getenv("VOL_BOOST_MULT", "1.2"))
 LOOKBACK_MIN           = int(os.getenv("LOOKBACK_MIN", "10"))
 
+# 포트폴리오 리스크 (진입 시 변동성/상관 기반 사이징)
+RISK_ENABLED           = os.getenv("RISK_ENABLED", "1") == "1"
+RISK_LOOKBACK          = int(os.getenv("RISK_LOOKBACK", "30"))               # 수익률 행렬 봉 수
+RISK_TARGET_VOL_PCT    = float(os.getenv("RISK_TARGET_VOL_PCT", "0.5"))      # 1분봉 σ 목표(%)
+RISK_MIN_SCALE         = float(os.getenv("RISK_MIN_SCALE", "0.3"))
+RISK_CORR_SOFT         = float(os.getenv("RISK_CORR_SOFT", "0.6"))
+RISK_MAX_CORR          = float(os.getenv("RISK_MAX_CORR", "0.9"))
+RISK_MAX_PORT_VOL_PCT  = float(os.getenv("RISK_MAX_PORT_VOL_PCT", "0.35"))   # 포트폴리오 1분봉 σ 상한(자산 대비 %)
+
 # 매도/리스크
 SL_PCT                 = float(os.getenv("SL_PCT", "1.2"))    # 기본 스탑로스
 TP_PCT                 = float(os.getenv("TP_PCT", "2.5"))    # 부분익절 트리거
@@ -104,15 +187,29 @@ REPORT_TZ              = os.getenv("REPORT_TZ", "Asia/Seoul")
 REPORT_HOUR            = int(os.getenv("REPORT_HOUR", "9"))
 REPORT_MINUTE          = int(os.getenv("REPORT_MINUTE", "0"))
 REPORT_SENT_FILE       = os.getenv("REPORT_SENT_FILE", "./last_report_date.txt")
+REPORT_PREP_SEC        = float(os.getenv("REPORT_PREP_SEC", "20"))   # 정시 전 스냅샷 선행 조회
+DUST_WORKERS           = int(os.getenv("DUST_WORKERS", "4"))
 
 # 운영
 NO_TRADE_MIN_AROUND_9  = int(os.getenv("NO_TRADE_MIN_AROUND_9", "3"))
+ORDER_RPS              = float(os.getenv("ORDER_RPS", "8"))           # 주문 API 공용 초당 한도
+TIMING_ENABLED         = os.getenv("TIMING_ENABLED", "1") == "1"   # 스캔/매니저 단계별 타이밍
+TIMING_RING            = int(os.getenv("TIMING_RING", "120"))     # 최근 사이클 보관 개수
+PROFILE_MAX_SEC        = float(os.getenv("PROFILE_MAX_SEC", "120"))
+PROFILE_MAX_HZ         = float(os.getenv("PROFILE_MAX_HZ", "100"))
+DEBUG_TOKEN            = os.getenv("DEBUG_TOKEN", "")                 # 비우면 프로파일러 비활성
 PERSIST_DIR            = os.getenv("PERSIST_DIR", "./")
 os.makedirs(PERSIST_DIR, exist_ok=True)
 CSV_FILE               = os.path.join(PERSIST_DIR, "trades.csv")
 POS_FILE               = os.path.join(PERSIST_DIR, "pos.json")
 BUDGET_FILE            = os.path.join(PERSIST_DIR, "budget.json")
 
+# 섀도 프로필 (가상 체결 비교용, 예: '[{"name":"tight","PRESTOP_PCT":0.7}]')
+SHADOW_PROFILES        = os.getenv("SHADOW_PROFILES", "").strip()
+SHADOW_ENTRY_KRW       = float(os.getenv("SHADOW_ENTRY_KRW", "100000"))
+SHADOW_CSV_FILE        = os.path.join(PERSIST_DIR, "shadow_trades.csv")
+SHADOW_POS_FILE        = os.path.join(PERSIST_DIR, "shadow_pos.json")
+
 # ===================== Globals =====================
 KST = timezone(timedelta(hours=9))
 UPBIT = pyupbit.Upbit(ACCESS_KEY, SECRET_KEY) if (ACCESS_KEY and SECRET_KEY) else None
@@ -122,6 +219,12 @@ POS: dict[str, dict] = {}
 COOLDOWN: dict[str, float] = {}
 BACKOFF = {"topn": TOPN_INITIAL, "scan_interval": SCAN_INTERVAL_SEC}
 RESERVED_POOL = 0.0   # under-min 잔액 누적 풀
+QUOTES: dict[str, tuple] = {}   # market → (price, epoch) 최근 티커 스냅샷/매니저 시세
+PARAM_KEYS = ("MAX_OPEN_POSITIONS","RSI_MAX_BOTTOM","EMA_NEAR_PCT","REBOUND_FROM_LOW_PCT","VOL_BOOST_MULT",
+              "LOOKBACK_MIN","SL_PCT","TP_PCT","TRAIL_ACTIVATE_PCT","TRAIL_PCT","PARTIAL_TP_RATIO",
+              "HARD_STOP_PCT","PRESTOP_PCT")
+LIVE_PARAMS = {k: globals()[k] for k in PARAM_KEYS}
+SCHED = {"cycles": 0, "skipped": 0, "last_lag_ms": 0.0, "max_lag_ms": 0.0, "stride_min": 1}
 
 # ===================== Telegram =====================
 def _post_telegram(text: str):
@@ -146,6 +249,7 @@ def get_price_safe(ticker, tries=3, delay=0.6):
             if p: return float(p)
         except Exception as e:
             print(f"[price:{ticker}] {e}")
+        _tm_count("price_retry")
         time.sleep(delay*(i+1))
     return None
 
@@ -156,16 +260,18 @@ def get_ohlcv_safe(ticker, count=60, interval="minute1", tries=3, delay=0.6):
             if df is not None and not df.empty: return df
         except Exception as e:
             print(f"[ohlcv:{ticker}] {e}")
+        _tm_count("ohlcv_retry")
         time.sleep(delay*(i+1))
     return None
 
-def save_pos():
+def save_pos(prices=None):
+    # prices: 이미 받아둔 시세 맵(있으면 재조회 생략)
     with POS_LOCK:
         obj = {}
         for t, p in POS.items():
             qty = float(p.get("qty", 0.0))
             if qty <= 0: continue
-            price = get_price_safe(t) or p.get("avg", 0.0)
+            price = (prices or {}).get(t) or get_price_safe(t) or p.get("avg", 0.0)
             if qty*(price or 0.0) < DUST_LIMIT_KRW: continue
             obj[t] = {
                 "qty": qty, "avg": float(p.get("avg", 0.0)),
@@ -175,6 +281,7 @@ def save_pos():
                 "cooldown_until": float(p.get("cooldown_until", 0.0)),
                 "trail_alerted": bool(p.get("trail_alerted", False)),
                 "trail_last_alert_price": float(p.get("trail_last_alert_price", 0.0)),
+                "strategy": p.get("strategy"),
             }
     tmp = POS_FILE + ".tmp"
     with open(tmp, "w", encoding="utf-8") as f: json.dump(obj, f, ensure_ascii=False, indent=2)
@@ -200,16 +307,136 @@ def load_pos():
                 "cooldown_until": float(p.get("cooldown_until", 0.0)),
                 "trail_alerted": bool(p.get("trail_alerted", False)),
                 "trail_last_alert_price": float(p.get("trail_last_alert_price", 0.0)),
+                "strategy": p.get("strategy"),
             }
 
+CSV_HEADER = ["ts","ticker","side","qty","price","krw","fee","pnl_krw","pnl_pct","note",
+              "trigger_px","t_decision","t_submit","t_ack","t_fill","retries","slip_bps"]
+def _migrate_csv_header():
+    # 구버전 trades.csv(트레이스 컬럼 없음)는 헤더 확장 후 재작성 — init_bot에서 스레드 시작 전 1회
+    if not os.path.exists(CSV_FILE): return
+    with open(CSV_FILE, newline="", encoding="utf-8") as f:
+        rd = csv.DictReader(f)
+        if rd.fieldnames == CSV_HEADER: return
+        rows = list(rd)
+    tmp = CSV_FILE + ".tmp"
+    with open(tmp, "w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=CSV_HEADER, extrasaction="ignore")
+        w.writeheader(); w.writerows(rows)
+    os.replace(tmp, CSV_FILE)
+
 def append_csv(row: dict):
-    header = ["ts","ticker","side","qty","price","krw","fee","pnl_krw","pnl_pct","note"]
     exists = os.path.exists(CSV_FILE)
     with open(CSV_FILE, "a", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(f, fieldnames=header)
+        w = csv.DictWriter(f, fieldnames=CSV_HEADER)
         if not exists: w.writeheader()
         w.writerow(row)
 
+# ===================== Profiling =====================
+# 스캔/매니저 한 사이클의 단계별 소요시간을 링버퍼에 보관 (/debug/timings)
+# 비활성(TIMING_ENABLED=0) 시 _stage()는 nullcontext만 반환
+class CycleTimer:
+    __slots__ = ("kind", "ts", "t0", "total", "stages", "counts", "meta")
+
+    def __init__(self, kind):
+        self.kind = kind; self.ts = time.time(); self.t0 = time.perf_counter()
+        self.total = 0.0; self.stages = {}; self.counts = {}; self.meta = {}
+
+    @contextmanager
+    def stage(self, name):
+        t = time.perf_counter()
+        try: yield
+        finally:
+            st = self.stages.get(name)
+            if st is None: st = self.stages[name] = [0.0, 0]
+            st[0] += time.perf_counter() - t; st[1] += 1
+
+    def as_dict(self):
+        return {"ts": datetime.fromtimestamp(self.ts, KST).strftime("%H:%M:%S.%f")[:-3],
+                "total_ms": round(self.total*1000, 2),
+                "stages": {k: {"ms": round(v[0]*1000, 2), "n": v[1]} for k, v in self.stages.items()},
+                "counts": dict(self.counts), **self.meta}
+
+TIMINGS = {"scan": deque(maxlen=TIMING_RING), "manager": deque(maxlen=TIMING_RING)}
+_TM_LOCAL = threading.local()
+
+@contextmanager
+def _cycle(kind):
+    if not TIMING_ENABLED:
+        yield None; return
+    tm = CycleTimer(kind); _TM_LOCAL.cur = tm
+    try: yield tm
+    finally:
+        tm.total = time.perf_counter() - tm.t0
+        _TM_LOCAL.cur = None
+        TIMINGS[kind].append(tm)
+
+def _stage(name):
+    tm = getattr(_TM_LOCAL, "cur", None)
+    return tm.stage(name) if tm is not None else nullcontext()
+
+def _tm_count(name, n=1):
+    tm = getattr(_TM_LOCAL, "cur", None)
+    if tm is not None: tm.counts[name] = tm.counts.get(name, 0) + n
+
+def _pct(vals, q):
+    if not vals: return 0.0
+    s = sorted(vals)
+    return float(s[min(len(s)-1, int(round(q/100.0*(len(s)-1))))])
+
+def _timing_summary(cycles):
+    totals = [c.total*1000 for c in cycles]
+    per = {}
+    for c in cycles:
+        for k, v in c.stages.items(): per.setdefault(k, []).append(v[0]*1000)
+    out = {"total": {"p50": _pct(totals, 50), "p95": _pct(totals, 95), "max": max(totals, default=0.0)}}
+    for k, v in per.items():
+        out[k] = {"p50": _pct(v, 50), "p95": _pct(v, 95), "max": max(v)}
+    return out
+
+# 샘플링 프로파일러: start 시에만 스레드 기동, 결과는 collapsed-stack("a;b;c N") 텍스트
+class SamplingProfiler:
+    def __init__(self):
+        self.lock = threading.Lock(); self.thread = None; self.stop_ev = threading.Event()
+        self.stacks = Counter(); self.samples = 0
+
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, seconds, interval):
+        with self.lock:
+            if self.running(): return False
+            self.stacks = Counter(); self.samples = 0; self.stop_ev.clear()
+            self.thread = threading.Thread(target=self._run, args=(seconds, interval),
+                                           name="profiler", daemon=True)
+            self.thread.start()
+            return True
+
+    def stop(self):
+        self.stop_ev.set()
+        th = self.thread
+        if th is not None: th.join(timeout=2)
+
+    def _run(self, seconds, interval):
+        me = threading.get_ident(); until = time.time() + seconds
+        while not self.stop_ev.is_set() and time.time() < until:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for tid, fr in sys._current_frames().items():
+                if tid == me: continue
+                stack = []
+                while fr is not None:
+                    stack.append(f"{os.path.basename(fr.f_code.co_filename)}:{fr.f_code.co_name}")
+                    fr = fr.f_back
+                stack.append(names.get(tid, str(tid)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+            self.stop_ev.wait(interval)
+
+    def collapsed(self):
+        return "\n".join(f"{k} {v}" for k, v in self.stacks.most_common()) + "\n"
+
+PROFILER = SamplingProfiler()
+
 # ===================== Exchange helpers =====================
 def get_balance_krw():
     try: return float(UPBIT.get_balance("KRW") or 0.0)
@@ -237,44 +464,86 @@ def _rate_gate(sym, cooldown=0.8):
     wait = cooldown - max(0.0, time.time() - last)
     if wait > 0: time.sleep(wait)
 
-def safe_buy_market(market: str, krw_amount: float):
+_order_lock = threading.Lock()
+_order_next = 0.0
+def _order_slot():
+    # 전 스레드 공용 주문 간격 (1/ORDER_RPS) — 매수/매도/Dust 제출 직전에 호출
+    global _order_next
+    with _order_lock:
+        now = time.time()
+        at = max(now, _order_next)
+        _order_next = at + 1.0/max(0.1, ORDER_RPS)
+    if at > now: time.sleep(at - now)
+
+# ---- order lifecycle trace: decision → submit → ack → fill ----
+def _new_trace(trigger_px=None, t_decision=None):
+    return {"trigger_px": trigger_px, "t_decision": t_decision or time.time(),
+            "t_submit": None, "t_ack": None, "t_fill": None, "retries": 0, "polls": 0}
+
+def _finish_trace(tr, fill_px, side_sign):
+    # slip_bps: 불리한 방향이 양수 (매수: 체결가>트리거, 매도: 체결가<트리거)
+    # t_fill은 폴링에서 체결을 실제로 확인한 경우에만 기록 (타임아웃이면 공란)
+    tp = tr.get("trigger_px") or 0.0
+    tr["fill_px"] = fill_px
+    tr["slip_bps"] = (side_sign*(fill_px-tp)/tp*1e4) if (tp > 0 and fill_px) else None
+    return tr
+
+def _trace_cols(tr):
+    if not tr: return {}
+    r = lambda v, n: round(v, n) if v is not None else ""
+    return {"trigger_px": r(tr.get("trigger_px"), 8), "t_decision": r(tr.get("t_decision"), 3),
+            "t_submit": r(tr.get("t_submit"), 3), "t_ack": r(tr.get("t_ack"), 3),
+            "t_fill": r(tr.get("t_fill"), 3), "retries": tr.get("retries", 0),
+            "slip_bps": r(tr.get("slip_bps"), 2)}
+
+def safe_buy_market(market: str, krw_amount: float, trigger_px=None, t_decision=None):
     if krw_amount < MIN_ORDER_KRW:
         return {"status":"SKIP","reason":"under_min_order"}
+    tr = _new_trace(trigger_px, t_decision)
     sym = market.split("-")[1].upper()
     _rate_gate(sym)
     krw_before = get_balance_krw()
     coin_before = get_balance_coin(sym)
     resp = None
-    for _ in range(5):
+    tr["t_submit"] = time.time()
+    for i in range(5):
+        _order_slot()
         try: resp = UPBIT.buy_market_order(market, krw_amount*0.9990)
         except Exception: resp = None
         _last_order_at[sym] = time.time()
         if resp: break
+        tr["retries"] = i+1
         time.sleep(0.6)
-    if not resp: return {"status":"FAIL","reason":"resp_none"}
+    if not resp: return {"status":"FAIL","reason":"resp_none","trace":tr}
+    tr["t_ack"] = time.time()
     t0 = time.time()
     while time.time()-t0 < 30:
-        if get_balance_coin(sym) > coin_before + 1e-9: break
+        tr["polls"] += 1
+        if get_balance_coin(sym) > coin_before + 1e-9:
+            tr["t_fill"] = time.time(); break
         time.sleep(0.5)
     coin_after = get_balance_coin(sym)
     qty = max(0.0, coin_after - coin_before)
     krw_after = get_balance_krw()
     spent = max(0.0, krw_before - krw_after)
     avg = spent/qty if qty>0 else (get_price_safe(market) or 0.0)
-    return {"status":"OK","avg":avg,"qty":qty,"spent":spent}
+    return {"status":"OK","avg":avg,"qty":qty,"spent":spent,"trace":_finish_trace(tr, avg, 1.0)}
 
-def safe_sell_market(market: str, portion: float = 1.0):
+def safe_sell_market(market: str, portion: float = 1.0, trigger_px=None, t_decision=None):
+    tr = _new_trace(trigger_px, t_decision)
     sym = market.split("-")[1].upper()
     bal_before = get_balance_coin(sym)
     if bal_before <= 0: return {"status":"EMPTY"}
     price_now = get_price_safe(market) or 0.0
     qty = math.floor(bal_before*portion*10**6)/10**6
+    krw_b = get_balance_krw()  # 제출 전 잔고 (즉시 체결 시 received 누락 방지)
     if qty*price_now < MIN_ORDER_KRW:
         est_all = bal_before*price_now
         if est_all < DUST_LIMIT_KRW:
             try:
-                _rate_gate(sym); _ = UPBIT.sell_market_order(market, bal_before)
-                _last_order_at[sym] = time.time()
+                _rate_gate(sym); _order_slot(); tr["t_submit"] = time.time()
+                _ = UPBIT.sell_market_order(market, bal_before)
+                _last_order_at[sym] = tr["t_ack"] = time.time()
             except Exception:
                 return {"status":"DUST_SKIP"}
         else:
@@ -282,32 +551,40 @@ def safe_sell_market(market: str, portion: float = 1.0):
     else:
         _rate_gate(sym)
         resp = None
-        for _ in range(5):
+        tr["t_submit"] = time.time()
+        for i in range(5):
+            _order_slot()
             try: resp = UPBIT.sell_market_order(market, qty)
             except Exception: resp = None
             _last_order_at[sym] = time.time()
             if resp: break
+            tr["retries"] = i+1
             time.sleep(0.5)
-        if not resp: return {"status":"FAIL","reason":"resp_none"}
+        if not resp: return {"status":"FAIL","reason":"resp_none","trace":tr}
+        tr["t_ack"] = time.time()
 
     # fill 측정 (정확한 avg_sell)
-    krw_b = get_balance_krw()
     time.sleep(0.6)
     krw_a = get_balance_krw()
     bal_a = get_balance_coin(sym)
     filled = max(0.0, bal_before - bal_a)
     received = max(0.0, krw_a - krw_b)
-    if filled <= 0:
+    tr["polls"] += 1
+    if filled > 0: tr["t_fill"] = time.time()
+    else:
         t0 = time.time()
         while time.time()-t0 < 30:
             bal_a = get_balance_coin(sym)
             krw_a = get_balance_krw()
             filled = max(0.0, bal_before - bal_a)
             received = max(0.0, krw_a - krw_b)
-            if filled > 0: break
+            tr["polls"] += 1
+            if filled > 0:
+                tr["t_fill"] = time.time(); break
             time.sleep(0.5)
     avg_sell = (received/filled) if filled>0 else (get_price_safe(market) or price_now)
-    return {"status":"OK","filled":filled,"received":received,"avg_sell":avg_sell}
+    return {"status":"OK","filled":filled,"received":received,"avg_sell":avg_sell,
+            "trace":_finish_trace(tr, avg_sell, -1.0)}
 
 # ===================== Indicators =====================
 def ema_last(values, span):
@@ -333,39 +610,318 @@ def rsi_last(values, period=14):
     rs = avg_gain/avg_loss
     return 100.0 - (100.0/(1.0+rs))
 
+def _indicators(closes, vols):
+    v10 = sum(vols[-11:-1])/10.0 if len(vols) >= 11 else sum(vols)/max(1,len(vols))
+    return {"last": closes[-1], "rsi": rsi_last(closes), "ema10": ema_last(closes, 10),
+            "ema20": ema_last(closes, 20), "v10": v10, "vlast": vols[-1]}
+
+def _entry_eval(ind, lows, P):
+    # 바닥 반등 조건 (P = 파라미터 dict, 라이브/섀도 공용)
+    last = ind["last"]
+    rsi_ok = (ind["rsi"] <= P["RSI_MAX_BOTTOM"])
+    ema_ok = (abs(last-ind["ema10"])/max(1e-9, ind["ema10"]) <= P["EMA_NEAR_PCT"]/100.0) or \
+             (abs(last-ind["ema20"])/max(1e-9, ind["ema20"]) <= P["EMA_NEAR_PCT"]/100.0)
+    recent_low = min(lows[-(int(P["LOOKBACK_MIN"])//2+5):])
+    rebound_ok = (last >= recent_low*(1+P["REBOUND_FROM_LOW_PCT"]/100.0))
+    vol_ok = (ind["vlast"] >= ind["v10"]*P["VOL_BOOST_MULT"])
+    score = (50-ind["rsi"]) + (ind["vlast"]/(ind["v10"]+1e-9)) + (last/max(1e-9, recent_low))
+    return rsi_ok, ema_ok, rebound_ok, vol_ok, score
+
+# ===================== Market data plane =====================
+# 전략들이 공유하는 캔들/지표/시세 캐시 — 같은 봉 구간(캐시 키) 안에서는 거래소 재요청 없음
+# 키: SCAN_ALIGN=candle → 마감된 1분봉 기준 분, fixed → CANDLE_TTL_SEC 구간
+MD_LOCK = threading.Lock()
+CANDLE_CACHE: dict[str, tuple] = {}   # market → (key, count, df)
+VIEW_CACHE: dict[str, tuple] = {}     # market → (key, n_bars, view)
+
+def _md_key() -> int:
+    return int(time.time()//60) if SCAN_ALIGN == "candle" else int(time.time()//max(1, CANDLE_TTL_SEC))
+
+def get_candles(market, count):
+    key = _md_key()
+    with MD_LOCK:
+        c = CANDLE_CACHE.get(market)
+    if c and c[0] == key and c[1] >= count: return c[2]
+    df = get_ohlcv_safe(market, count=count)
+    if df is not None and SCAN_ALIGN == "candle": df = _closed_only(df)
+    if df is not None:
+        with MD_LOCK: CANDLE_CACHE[market] = (key, count, df)
+    return df
+
+def market_view(market, df):
+    # 전략 공용 입력: OHLCV 리스트 + 기본 지표 (캐시 키 + 봉 개수당 1회 계산)
+    key = _md_key()
+    with MD_LOCK:
+        v = VIEW_CACHE.get(market)
+    if v and v[0] == key and v[1] == len(df): return v[2]
+    closes = df["close"].tolist(); vols = df["volume"].tolist()
+    view = {"market": market, "ts": list(df.index), "closes": closes, "highs": df["high"].tolist(), "lows": df["low"].tolist(),
+            "vols": vols, "ind": _indicators(closes, vols)}
+    with MD_LOCK: VIEW_CACHE[market] = (key, len(df), view)
+    return view
+
+def get_quote(market, max_age=5.0):
+    q = QUOTES.get(market)
+    if q and time.time() - q[1] <= max_age: return q[0]
+    p = get_price_safe(market)
+    if p: QUOTES[market] = (p, time.time())
+    return p
+
+def _md_prune():
+    key = _md_key()
+    with MD_LOCK:
+        for cache in (CANDLE_CACHE, VIEW_CACHE):
+            for m in [m for m, v in cache.items() if v[0] != key]: del cache[m]
+
+# ===================== Strategies =====================
+# 전략 인터페이스: entry_signal(진입 점수) / size(진입 금액) / exit_policy(청산 결정)
+# - 전략별 MAX_OPEN_POSITIONS, budget_ratio(예산 슬라이스), time_budget_ms(스캔 1회당 진입평가 시간)
+# - 진입평가는 스캐너 스레드(캔들/지표는 공용 캐시), 손절은 매니저 스레드가 별도로 전 포지션을 매 틱 처리
+#   GIL 공유로 무거운 진입평가가 매니저 틱을 늦출 수 있으므로 시간예산 초과 시 그 스캔의 남은 종목은 건너뜀
+#   (전략별 소요 strategy:<name>, 초과 횟수 strategy_over_budget → /debug/timings)
+# STRATEGIES='[{"name":"bottom","type":"bottom_rebound","MAX_OPEN_POSITIONS":2,"budget_ratio":0.6},
+#              {"name":"deep","type":"bottom_rebound","RSI_MAX_BOTTOM":30,"budget_ratio":0.4}]'
+class Strategy:
+    candle_count = 50
+    min_bars = 15
+
+    def __init__(self, name, max_open=MAX_OPEN_POSITIONS, budget_ratio=1.0, time_budget_ms=None):
+        self.name = name
+        self.max_open = int(max_open)
+        self.budget_ratio = float(budget_ratio)
+        self.time_budget_ms = float(STRATEGY_TIME_BUDGET_MS if time_budget_ms is None else time_budget_ms)
+
+    def entry_signal(self, view, stats=None):
+        # 진입 점수(높을수록 우선) 또는 None
+        return None
+
+    def size(self, per_slot, cap):
+        return min(per_slot, cap)
+
+    def exit_policy(self, p, price):
+        # _exit_decide와 같은 형태의 dict 반환 (label None = 보유 유지)
+        return {"label": None, "portion": 1.0, "pnl_pct": 0.0, "highest": max(p.get("highest", 0.0), price),
+                "trail_active": bool(p.get("trail_active", False)), "activated": False}
+
+class BottomRebound(Strategy):
+    def __init__(self, name, budget_ratio=1.0, time_budget_ms=None, **params):
+        unknown = [k for k in params if k not in LIVE_PARAMS]
+        if unknown: raise ValueError(f"unknown params {unknown}")
+        self.P = {**LIVE_PARAMS, **{k: type(LIVE_PARAMS[k])(v) for k, v in params.items()}}
+        super().__init__(name, self.P["MAX_OPEN_POSITIONS"], budget_ratio, time_budget_ms)
+        self.candle_count = max(int(self.P["LOOKBACK_MIN"])+25, 50)
+        self.min_bars = int(self.P["LOOKBACK_MIN"])+5
+
+    def entry_signal(self, view, stats=None):
+        if len(view["closes"]) < self.min_bars: return None
+        rsi_ok, ema_ok, rebound_ok, vol_ok, score = _entry_eval(view["ind"], view["lows"], self.P)
+        if stats is not None:
+            if not rsi_ok: stats["rsi_fail"] += 1
+            if not ema_ok: stats["ema_fail"] += 1
+            if not rebound_ok: stats["rebound_fail"] += 1
+            if not vol_ok: stats["vol_fail"] += 1
+        return score if (rsi_ok and ema_ok and rebound_ok and vol_ok) else None
+
+    def exit_policy(self, p, price):
+        return _exit_decide(p, price, self.P)
+
+STRATEGY_TYPES = {"bottom_rebound": BottomRebound}
+
+def _load_strategies():
+    confs = []
+    if STRATEGIES_CONF:
+        try: confs = json.loads(STRATEGIES_CONF)
+        except Exception as e: print(f"[strategy] STRATEGIES parse error: {e}")
+    out = []
+    if not isinstance(confs, list):
+        print("[strategy] STRATEGIES must be a JSON list"); confs = []
+    for i, c in enumerate(confs):
+        if not isinstance(c, dict):
+            print(f"[strategy] skipped #{i+1} (not an object)"); continue
+        c = dict(c); typ = c.pop("type", "bottom_rebound"); name = str(c.pop("name", f"{typ}{i+1}"))
+        cls = STRATEGY_TYPES.get(typ)
+        if cls is None or any(st.name == name for st in out):
+            print(f"[strategy] skipped {name} (type={typ})"); continue
+        try: out.append(cls(name, **c))
+        except Exception as e: print(f"[strategy] {name}: {e}")
+    return out or [BottomRebound("bottom")]
+
+STRATEGIES = _load_strategies()
+STRATEGY_BY_NAME = {st.name: st for st in STRATEGIES}
+
+def _strategy_for(p):
+    return STRATEGY_BY_NAME.get(p.get("strategy")) or STRATEGIES[0]
+
+def _open_by_strategy():
+    # 호출 측에서 POS_LOCK 보유 — 전략별 [보유 수, 투입 원금]
+    out = {st.name: [0, 0.0] for st in STRATEGIES}
+    for _, p in POS.items():
+        if p.get("qty",0.0) <= 0: continue
+        o = out.setdefault(_strategy_for(p).name, [0, 0.0])
+        o[0] += 1; o[1] += p.get("qty",0.0)*p.get("avg",0.0)
+    return out
+
+# ===================== Portfolio risk =====================
+# 진입 직전 리스크 단계: 보유+후보 종목의 1분봉 수익률 행렬(캐시 캔들)로 변동성/상관을 한 번에 계산
+# - 변동성 스케일: RISK_TARGET_VOL_PCT / σ (축소만, 하한 RISK_MIN_SCALE)
+# - 상관 패널티: 보유(+이번 스캔 체결) 종목과의 최대 상관이 RISK_CORR_SOFT~RISK_MAX_CORR 구간에서 선형 축소, 이상이면 제외
+# - 포트폴리오 σ(wᵀΣw)^½ ≤ RISK_MAX_PORT_VOL_PCT × 자산 이 되도록 진입 금액 상한(2차식 해)
+# - 이력 부족(RISK_LOOKBACK 미만)·σ=0(평탄/결측 보간) 종목은 σ/상관 추정 불가 → 하한 RISK_MIN_SCALE 크기로만 진입
+#   (상관 최대값·포트폴리오 σ 계산에서도 제외)
+def _aligned_closes(views, n_bars):
+    # 분봉 누락(무거래 분) 보정: 공통 시각 격자에 직전 종가로 채움
+    grid = sorted(set().union(*(v["ts"][-(n_bars+1):] for v in views)))[-(n_bars+1):]
+    cols = []
+    for v in views:
+        d = dict(zip(v["ts"], v["closes"]))
+        prev = next((d[t] for t in grid if t in d), v["closes"][-1])
+        col = []
+        for t in grid:
+            prev = d.get(t, prev); col.append(prev)
+        cols.append(col)
+    return np.array(cols, dtype=float).T
+
+def risk_plan(cand_markets, held_values, equity, count):
+    count = max(count, RISK_LOOKBACK+2)   # 마감봉만 쓰면 1봉 빠짐 → 수익률 RISK_LOOKBACK개 확보
+    views = []; names = []
+    for m in list(held_values) + [m for m in cand_markets if m not in held_values]:
+        # market data plane 캐시 경유 — 이번 스캔 후보는 재조회/재계산 없음, 보유 종목만 필요 시 조회
+        df = get_candles(m, count)
+        if df is None: continue
+        view = market_view(m, df)
+        if len(view["closes"]) < RISK_LOOKBACK+1: continue
+        views.append(view); names.append(m)
+    if not names: return {"idx": {}, "equity": equity}
+    R = np.diff(np.log(np.maximum(_aligned_closes(views, RISK_LOOKBACK), 1e-12)), axis=0)
+    cov = np.atleast_2d(np.cov(R, rowvar=False))
+    sd = np.sqrt(np.clip(np.diag(cov), 0.0, None))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        corr = np.where(np.outer(sd, sd) > 0, cov/np.outer(sd, sd), 0.0)
+        scale = np.where(sd > 0, (RISK_TARGET_VOL_PCT/100.0)/sd, RISK_MIN_SCALE)   # σ=0(평탄/결측) → 추정 불가 → 하한
+    np.fill_diagonal(corr, 1.0)
+    w = np.array([held_values.get(m, 0.0) for m in names], dtype=float)
+    return {"idx": {m: i for i, m in enumerate(names)}, "cov": cov, "corr": corr, "sd": sd,
+            "scale": np.clip(scale, RISK_MIN_SCALE, 1.0), "w": w, "equity": equity}
+
+def risk_size(rk, market, amt):
+    # → (조정 금액, 사유|None)
+    j = rk["idx"].get(market)
+    if j is None: return amt*RISK_MIN_SCALE, f"bars<{RISK_LOOKBACK+1}"
+    w = rk["w"]; held = (w > 0) & (rk["sd"] > 0)
+    rho = float(rk["corr"][j, held].max()) if held.any() else 0.0
+    if rho >= RISK_MAX_CORR: return 0.0, f"corr {rho:.2f}"
+    scale = float(rk["scale"][j])
+    if rho > RISK_CORR_SOFT:
+        scale *= 1.0 - (1.0-RISK_MIN_SCALE)*(rho-RISK_CORR_SOFT)/max(1e-9, RISK_MAX_CORR-RISK_CORR_SOFT)
+    a = amt*scale
+    cap = RISK_MAX_PORT_VOL_PCT/100.0*rk["equity"]
+    cov = rk["cov"]; A = float(w @ cov @ w); B = float((cov @ w)[j]); C = float(cov[j, j])
+    if C > 0 and A + 2*a*B + a*a*C > cap*cap:
+        disc = B*B - C*(A - cap*cap)
+        a = max(0.0, (-B + math.sqrt(disc))/C) if disc > 0 else 0.0
+    if rk["sd"][j] <= 0: return a, "σ n/a"
+    why = None if a >= amt*0.999 else f"σ {rk['sd'][j]*100:.2f}% ρ {rho:.2f}"
+    return a, why
+
+def risk_commit(rk, market, spent):
+    j = rk["idx"].get(market)
+    if j is not None: rk["w"][j] += spent
+
 # ===================== Scanner =====================
 TICKER_URL = "https://api.upbit.com/v1/ticker"
 _last_summary_ts = 0.0
 
-def fetch_top_by_turnover(krw_tickers, topn):
+def fetch_top_by_turnover(krw_tickers, topn, allowed=None):
+    # krw_tickers 전체 스냅샷은 QUOTES에 반영(섀도/리스크 시세 공용), 순위는 allowed(None=전체)만 대상
     res = []
     try:
-        CHUNK = 90
+        CHUNK = 90; limited = False
         for i in range(0, len(krw_tickers), CHUNK):
             chunk = krw_tickers[i:i+CHUNK]
             r = requests.get(TICKER_URL, params={"markets":",".join(chunk)}, timeout=5)
             if r.status_code == 429:
                 BACKOFF["topn"] = max(15, BACKOFF["topn"]-5)
                 BACKOFF["scan_interval"] = min(90, BACKOFF["scan_interval"]+15)
+                limited = True
                 continue
             r.raise_for_status()
+            ts = time.time()
             for d in r.json():
+                QUOTES[d["market"]] = (float(d["trade_price"]), ts)
+                if allowed is not None and d["market"] not in allowed: continue
                 res.append({"market":d["market"],"price":float(d["trade_price"]),
-                            "turnover24h":float(d.get("acc_trade_price_24h",0.0))})
+                            "turnover24h":float(d.get("acc_trade_price_24h",0.0)),
+                            "low":float(d.get("low_price") or 0.0),"high":float(d.get("high_price") or 0.0),
+                            "chg_pct":float(d.get("signed_change_rate") or 0.0)*100.0})
             time.sleep(0.08)
+        if not limited:
+            # 429 없이 지나가면 백오프를 점진 복구
+            BACKOFF["scan_interval"] = max(SCAN_INTERVAL_SEC, BACKOFF["scan_interval"]-5)
+            if BACKOFF["topn"] < TOPN_INITIAL: BACKOFF["topn"] += 1
         res.sort(key=lambda x: x["turnover24h"], reverse=True)
         return res[:topn]
     except Exception as e:
         send_telegram(f"⚠️ 거래대금 조회 실패: {e}")
         return []
 
-def _summary(cand_cnt, slots_left, per_slot, stats=None):
+def _prefilter(snap, stats, rebound_pct=None, window_min=None):
+    # 1단계(무료): 티커 스냅샷만으로 바닥반등 불가 종목 제거 → 생존 종목만 OHLCV 조회
+    # 최근 저가 창이 09:00 일봉 리셋 이후에만 걸쳐 있으면 최근 저가 ≥ 일중 저가
+    # → 현재가 < 일저가×(1+REBOUND) 이면 rebound_ok 불가. 창이 리셋을 넘으면(리셋 직후)
+    #   일저가가 리셋 이후 값뿐이라 성립 안 함 → 저가 검사 생략
+    if window_min is None: window_min = LOOKBACK_MIN//2+5
+    n = now_kst()
+    since_reset = (n - n.replace(hour=9, minute=0, second=0, microsecond=0)).total_seconds()/60.0
+    check_low = not (0 <= since_reset < window_min+1)
+    out = []
+    for it in snap:
+        stats["pre_in"] += 1
+        px, lo, hi = it["price"], it["low"], it["high"]
+        if px < MIN_PRICE_KRW:
+            stats["pre_price_fail"] += 1; continue
+        if check_low and (lo <= 0 or px < lo*(1+(REBOUND_FROM_LOW_PCT if rebound_pct is None else rebound_pct)/100.0)):
+            stats["pre_rebound_fail"] += 1; continue
+        pos = (px-lo)/(hi-lo) if hi > lo else 1.0
+        if pos > PREFILTER_MAX_RANGE_POS:
+            stats["pre_range_fail"] += 1; continue
+        if it["chg_pct"] > PREFILTER_MAX_CHG_PCT:
+            stats["pre_chg_fail"] += 1; continue
+        it["prescore"] = 1.0 - pos
+        out.append(it); stats["pre_ok"] += 1
+    out.sort(key=lambda x: (x["prescore"], x["turnover24h"]), reverse=True)
+    return out
+
+def fetch_quotes(markets, _retry=True):
+    # 여러 종목 현재가를 /v1/ticker 배치 요청으로 조회 (QUOTES 갱신)
+    # 상장폐지 종목이 섞이면 배치 전체가 404 → 상장 목록으로 걸러 1회 재시도
+    out = {}; failed = []
+    for i in range(0, len(markets), 90):
+        chunk = markets[i:i+90]
+        try:
+            r = requests.get(TICKER_URL, params={"markets":",".join(chunk)}, timeout=5)
+            r.raise_for_status()
+            ts = time.time()
+            for d in r.json():
+                out[d["market"]] = float(d["trade_price"]); QUOTES[d["market"]] = (out[d["market"]], ts)
+        except Exception as e:
+            print(f"[quotes] {e}"); failed += chunk
+    if failed and _retry:
+        try: listed = set(pyupbit.get_tickers("KRW"))
+        except Exception: listed = set()
+        out.update(fetch_quotes([m for m in failed if m in listed], _retry=False))
+    return out
+
+def _summary(cand_cnt, slots_left, per_slot, stats=None, by_strategy=None):
     global _last_summary_ts
     if time.time() - _last_summary_ts < 600: return
     _last_summary_ts = time.time()
     base = f"🔎 스캔요약: 후보 {cand_cnt} / TOPN={BACKOFF['topn']} / slots_left={slots_left} / per_entry≈₩{per_slot:,.0f}"
     if stats:
+        base += (f"\npre={stats['pre_in']}→{stats['pre_ok']} | fail price={stats['pre_price_fail']}, "
+                 f"low={stats['pre_rebound_fail']}, range={stats['pre_range_fail']}, chg={stats['pre_chg_fail']}")
         base += f"\nscan={stats['scanned']} | ok={stats['ok']} | fail rsi={stats['rsi_fail']}, ema={stats['ema_fail']}, rebound={stats['rebound_fail']}, vol={stats['vol_fail']}"
+    if by_strategy:
+        base += "\n전략 후보: " + " | ".join(f"{k}={len(v)}" for k, v in by_strategy.items())
     send_telegram(base)
 
 # ---- budget helpers for percent_base ----
@@ -397,20 +953,26 @@ def _ensure_base_budget(current_cash: float) -> float:
 def scan_once_and_maybe_buy():
     global RESERVED_POOL
 
+    # 섀도 청산: 이미 받아둔 시세(QUOTES)만 사용 — 아래 조기 종료와 무관, 거래소 요청 없음
+    if SHADOW_BOOKS:
+        with _stage("shadow"): _shadow_mark_quotes()
+
     # 09:00 변동성 보호
     k = now_kst()
     if k.hour == 9 and k.minute < NO_TRADE_MIN_AROUND_9:
         return
 
-    # 슬롯
+    # 슬롯 (전략별 MAX_OPEN_POSITIONS)
     with POS_LOCK:
-        open_cnt = sum(1 for _, p in POS.items() if p.get("qty",0.0) > 0)
-    slots_left = max(0, MAX_OPEN_POSITIONS - open_cnt)
+        open_by = _open_by_strategy()
+    slots_by = {st.name: max(0, st.max_open - open_by[st.name][0]) for st in STRATEGIES}
+    slots_left = sum(slots_by.values())
     if slots_left == 0: return
 
     # 유니버스
     try:
-        all_tk = [t for t in pyupbit.get_tickers("KRW") if t not in EXCLUDED_TICKERS]
+        with _stage("tickers"):
+            all_tk = [t for t in pyupbit.get_tickers("KRW") if t not in EXCLUDED_TICKERS]
     except Exception as e:
         send_telegram(f"⚠️ 티커 조회 실패: {e}"); return
 
@@ -422,65 +984,77 @@ def scan_once_and_maybe_buy():
             if t in POS and POS[t].get("qty",0.0) > 0: continue
         uni.append(t)
 
-    topN = fetch_top_by_turnover(uni, BACKOFF["topn"])
-    if not topN:
+    with _stage("turnover"):
+        pool = fetch_top_by_turnover(all_tk, BACKOFF["topn"]*max(1, PREFILTER_POOL_MULT), allowed=set(uni))
+    if SHADOW_BOOKS:
+        with _stage("shadow"): _shadow_mark_quotes()
+    if not pool:
         _summary(0, slots_left, 0.0)
         return
 
-    # 후보 평가 (바닥 반등)
-    cands = []
-    stats = {"scanned":0,"rsi_fail":0,"ema_fail":0,"rebound_fail":0,"vol_fail":0,"ok":0}
+    stats = {"pre_in":0,"pre_price_fail":0,"pre_rebound_fail":0,"pre_range_fail":0,"pre_chg_fail":0,"pre_ok":0,
+             "scanned":0,"rsi_fail":0,"ema_fail":0,"rebound_fail":0,"vol_fail":0,"ok":0}
+    with _stage("prefilter"):
+        loosest = min(getattr(st, "P", LIVE_PARAMS)["REBOUND_FROM_LOW_PCT"] for st in STRATEGIES)
+        widest = max(int(getattr(st, "P", LIVE_PARAMS)["LOOKBACK_MIN"])//2+5 for st in STRATEGIES)
+        topN = _prefilter(pool, stats, rebound_pct=loosest, window_min=widest)[:BACKOFF["topn"]]
+
+    # 후보 평가 — 캔들/지표는 market data plane에서 1회, 전략별 진입평가는 그 결과를 공유
+    _md_prune()
+    cands = {st.name: [] for st in STRATEGIES}; shadow_feed = []
+    active = [st for st in STRATEGIES if slots_by[st.name] > 0]
+    used_ms = {st.name: 0.0 for st in active}
+    count = max(st.candle_count for st in STRATEGIES)
+    min_bars = min(st.min_bars for st in STRATEGIES)
     for it in topN:
-        t = it["market"]; px = it["price"]
-        if px < MIN_PRICE_KRW: continue
-        df = get_ohlcv_safe(t, count=max(LOOKBACK_MIN+25, 50))
-        if df is None or len(df) < LOOKBACK_MIN+5: continue
-
-        closes = df["close"].tolist()
-        highs  = df["high"].tolist()
-        lows   = df["low"].tolist()
-        vols   = df["volume"].tolist()
-        stats["scanned"] += 1
-
-        rsi_ok = (rsi_last(closes) <= RSI_MAX_BOTTOM)
-        if not rsi_ok: stats["rsi_fail"] += 1
-
-        ema10 = ema_last(closes, 10); ema20 = ema_last(closes, 20)
-        last = closes[-1]
-        ema_ok = (abs(last-ema10)/max(1e-9, ema10) <= EMA_NEAR_PCT/100.0) or \
-                 (abs(last-ema20)/max(1e-9, ema20) <= EMA_NEAR_PCT/100.0)
-        if not ema_ok: stats["ema_fail"] += 1
-
-        recent_low = min(lows[-(LOOKBACK_MIN//2+5):])
-        rebound_ok = (last >= recent_low*(1+REBOUND_FROM_LOW_PCT/100.0))
-        if not rebound_ok: stats["rebound_fail"] += 1
-
-        v10 = sum(vols[-11:-1])/10.0 if len(vols) >= 11 else sum(vols)/max(1,len(vols))
-        vol_ok = (vols[-1] >= v10*VOL_BOOST_MULT)
-        if not vol_ok: stats["vol_fail"] += 1
-
-        if rsi_ok and ema_ok and rebound_ok and vol_ok:
-            score = (50-rsi_last(closes)) + (vols[-1]/(v10+1e-9)) + (last/recent_low)
-            cands.append((t, score, last, it["turnover24h"])); stats["ok"] += 1
-        time.sleep(0.03+0.02*random.random())
+        t = it["market"]
+        with _stage("ohlcv"):
+            df = get_candles(t, count)
+        if df is None or len(df) < min_bars: continue
+
+        with _stage("indicators"):
+            view = market_view(t, df)
+            stats["scanned"] += 1
+        # 트리거가 = 결정 시점 티커 스냅샷가 (마감봉 종가가 아닌 현재가 기준 슬리피지)
+        px_now = (QUOTES.get(t) or (it["price"],))[0]
+        for st in active:
+            if used_ms[st.name] >= st.time_budget_ms: continue
+            t0 = time.perf_counter()
+            with _stage(f"strategy:{st.name}"):
+                score = st.entry_signal(view, stats if st is STRATEGIES[0] else None)
+            used_ms[st.name] += (time.perf_counter()-t0)*1000.0
+            if used_ms[st.name] >= st.time_budget_ms:
+                _tm_count("strategy_over_budget"); print(f"[strategy] {st.name} over budget ({used_ms[st.name]:.0f}ms)")
+            if score is not None:
+                cands[st.name].append((t, score, px_now, it["turnover24h"], time.time()))
+                if st is STRATEGIES[0]: stats["ok"] += 1
+        if SHADOW_BOOKS: shadow_feed.append((t, view["ind"], view["lows"], it["turnover24h"], px_now))
+        with _stage("pace"):
+            time.sleep(0.03+0.02*random.random())
+    n_cands = sum(len(v) for v in cands.values())
+
+    if SHADOW_BOOKS:
+        with _stage("shadow"): _shadow_entries(shadow_feed)
 
     # ===== 예산 계산 =====
-    krw_cash = get_balance_krw()
+    with _stage("balance"):
+        krw_cash = get_balance_krw()
     usable = krw_cash * (1.0 - CASH_BUFFER_PCT) + RESERVED_POOL
     if usable < MIN_ORDER_KRW:
         RESERVED_POOL = max(0.0, usable)
-        _summary(len(cands), slots_left, 0.0, stats)
+        _summary(n_cands, slots_left, 0.0, stats)
         return
 
     if ENTRY_MODE == "percent_base":
         # 기준예산 = 관측된 '현금 최대치'(KRW + RESERVED_POOL)
-        base_budget = _ensure_base_budget(krw_cash + RESERVED_POOL)
+        with _stage("base_budget"):
+            base_budget = _ensure_base_budget(krw_cash + RESERVED_POOL)
         per_entry = max(MIN_ORDER_KRW, base_budget * ENTRY_RATIO)
         per_entry = min(per_entry, usable)
         slots_to_use = min(slots_left, int(usable // per_entry))
         if slots_to_use <= 0:
             RESERVED_POOL = usable
-            _summary(len(cands), slots_left, 0.0, stats)
+            _summary(n_cands, slots_left, 0.0, stats)
             return
         per_slot = per_entry
 
@@ -490,7 +1064,7 @@ def scan_once_and_maybe_buy():
         slots_to_use = min(slots_left, int(usable // per_entry))
         if slots_to_use <= 0:
             RESERVED_POOL = usable
-            _summary(len(cands), slots_left, 0.0, stats)
+            _summary(n_cands, slots_left, 0.0, stats)
             return
         per_slot = per_entry
 
@@ -503,47 +1077,100 @@ def scan_once_and_maybe_buy():
             slots_to_use = min(slots_left, int(usable // MIN_ORDER_KRW))
             if slots_to_use == 0:
                 RESERVED_POOL = usable
-                _summary(len(cands), slots_left, 0.0, stats)
+                _summary(n_cands, slots_left, 0.0, stats)
                 return
 
-    _summary(len(cands), slots_to_use, per_slot, stats)
+    _summary(n_cands, slots_to_use, per_slot, stats, cands if len(STRATEGIES) > 1 else None)
 
-    if not cands:
+    if not n_cands:
         RESERVED_POOL = usable
         return
 
-    cands.sort(key=lambda x: (x[1], x[3]), reverse=True)
-    picks = cands[:slots_to_use]
-
-    spent_total = 0.0
-    for (t,_,__,___) in picks:
-        br = safe_buy_market(t, per_slot)
-        if br.get("status")=="OK" and br.get("qty",0)>0:
-            avg, qty, spent = br["avg"], br["qty"], br["spent"]
-            with POS_LOCK:
-                POS[t] = {
-                    "qty": float(qty), "avg": float(avg),
-                    "entry_ts": now_str(), "highest": float(avg),
-                    "trail_active": False, "partial_tp_done": False,
-                    "trail_alerted": False, "trail_last_alert_price": 0.0,
-                    "cooldown_until": 0.0,
-                }
-            save_pos()
-            spent_total += spent
-            send_telegram(
-                "🚀 매수 체결\n"
-                f"— 심볼: {t}\n"
-                f"— 수량: {qty:.6f}\n"
-                f"— 체결가: ₩{avg:,.4f}\n"
-                f"— 투자금액: ₩{spent:,.0f}\n"
-                f"— 기준: " + ("총금액 50% (percent_base)" if ENTRY_MODE=="percent_base" else ("고정 예산" if ENTRY_MODE=="fixed" else "현금×(1-버퍼) 균등"))
-            )
-            append_csv({"ts": now_str(),"ticker": t,"side":"BUY","qty": qty,"price": avg,
-                        "krw": -spent,"fee": spent*FEE_RATE,"pnl_krw":0,"pnl_pct":0,"note":"bottom_entry"})
+    # 전략 순서대로 슬롯/예산 슬라이스 안에서 배분 (같은 종목 중복 진입 없음)
+    invested_total = sum(v[1] for v in open_by.values())
+    risk = None
+    if RISK_ENABLED:
+        with POS_LOCK:
+            held = {t: p["qty"]*((QUOTES.get(t) or (p.get("avg",0.0),))[0])
+                    for t, p in POS.items() if p.get("qty",0.0) > 0}
+        with _stage("risk"):
+            risk = risk_plan([c[0] for v in cands.values() for c in v], held, usable + invested_total, count)
+    picked = set(); spent_total = 0.0; slots_rem = slots_to_use
+    for st in STRATEGIES:
+        n_s = slots_by[st.name]; spent_s = 0.0
+        for (t, _, trig_px, __, t_dec) in sorted(cands[st.name], key=lambda x: (x[1], x[3]), reverse=True):
+            if n_s <= 0 or slots_rem <= 0: break
+            if t in picked: continue
+            cap = (usable + invested_total)*st.budget_ratio - open_by[st.name][1] - spent_s
+            amt = st.size(per_slot, min(cap, usable - spent_total))
+            if amt < MIN_ORDER_KRW: break
+            base_amt = amt; why = None
+            if risk is not None:
+                amt, why = risk_size(risk, t, amt)
+                if amt < MIN_ORDER_KRW:
+                    _tm_count("risk_skip"); print(f"[risk] skip {t}: {why}"); continue
+                if why: _tm_count("risk_scaled")
+            picked.add(t); n_s -= 1; slots_rem -= 1
+            with _stage("buy"):
+                br = safe_buy_market(t, amt, trigger_px=trig_px, t_decision=t_dec)
+            if br.get("status")=="OK" and br.get("qty",0)>0:
+                avg, qty, spent = br["avg"], br["qty"], br["spent"]
+                with POS_LOCK:
+                    POS[t] = {
+                        "qty": float(qty), "avg": float(avg),
+                        "entry_ts": now_str(), "highest": float(avg),
+                        "trail_active": False, "partial_tp_done": False,
+                        "trail_alerted": False, "trail_last_alert_price": 0.0,
+                        "cooldown_until": 0.0, "strategy": st.name,
+                    }
+                with _stage("save_pos"):
+                    save_pos()
+                spent_total += spent; spent_s += spent
+                if risk is not None: risk_commit(risk, t, spent)
+                send_telegram(
+                    "🚀 매수 체결\n"
+                    f"— 심볼: {t}\n"
+                    + (f"— 전략: {st.name}\n" if len(STRATEGIES) > 1 else "") +
+                    f"— 수량: {qty:.6f}\n"
+                    f"— 체결가: ₩{avg:,.4f}\n"
+                    f"— 투자금액: ₩{spent:,.0f}\n"
+                    + (f"— 리스크 조정: ×{amt/base_amt:.2f} ({why})\n" if why else "") +
+                    f"— 기준: " + ("총금액 50% (percent_base)" if ENTRY_MODE=="percent_base" else ("고정 예산" if ENTRY_MODE=="fixed" else "현금×(1-버퍼) 균등"))
+                )
+                append_csv({"ts": now_str(),"ticker": t,"side":"BUY","qty": qty,"price": avg,
+                            "krw": -spent,"fee": spent*FEE_RATE,"pnl_krw":0,"pnl_pct":0,"note":f"{st.name}_entry",
+                            **_trace_cols(br.get("trace"))})
 
     RESERVED_POOL = max(0.0, usable - spent_total)
 
 # ===================== Manager (TP/SL/Trail + PreStop) =====================
+def _exit_decide(p, price, P):
+    # 순서: 프리-스톱 → (트레일 활성화) → 하드스톱 → 손절/트레일 라인 → 부분익절 → 트레일 청산
+    # 라이브 매니저와 섀도 프로필이 같은 규칙을 공유 (P = 파라미터 dict)
+    avg = p.get("avg",0.0)
+    pnl = (price-avg)/avg*100.0
+    highest = max(p.get("highest",avg), price)
+    trail_active = bool(p.get("trail_active", False)); activated = False
+    d = {"label": None, "portion": 1.0, "pnl_pct": pnl, "highest": highest}
+    if pnl <= -P["PRESTOP_PCT"]:
+        d["label"] = "PRE-STOP"
+    else:
+        if (not trail_active) and pnl >= P["TRAIL_ACTIVATE_PCT"]:
+            trail_active = activated = True
+        sl_price = avg*(1 - P["SL_PCT"]/100.0)
+        trail_line = highest*(1 - P["TRAIL_PCT"]/100.0)
+        dyn_sl = max(sl_price, trail_line) if trail_active else sl_price
+        if pnl <= -P["HARD_STOP_PCT"]:
+            d["label"] = "EMERGENCY_STOP"
+        elif price <= dyn_sl and pnl < P["TP_PCT"]:
+            d["label"] = "STOP/TRAIL"
+        elif (not p.get("partial_tp_done", False)) and pnl >= P["TP_PCT"]:
+            d["label"] = "PARTIAL_TP"; d["portion"] = P["PARTIAL_TP_RATIO"]
+        elif trail_active and price <= trail_line:
+            d["label"] = "TRAIL"
+    d["trail_active"] = trail_active; d["activated"] = activated
+    return d
+
 def manage_positions_once():
     with POS_LOCK:
         items = list(POS.items())
@@ -552,68 +1179,35 @@ def manage_positions_once():
         qty = p.get("qty",0.0)
         if qty <= 0: continue
         avg = p.get("avg",0.0)
-        price = get_price_safe(t)
+        with _stage("price"):
+            price = get_price_safe(t)
+        t_dec = time.time()
         if not price or avg<=0: continue
+        QUOTES[t] = (price, t_dec)
+        if SHADOW_BOOKS:
+            with _stage("shadow"): _shadow_mark(t, price)
 
-        pnl_pct_now = (price-avg)/avg*100.0
-
-        # 최고가 선 갱신
-        highest = max(p.get("highest",avg), price)
-        trail_active = bool(p.get("trail_active", False))
-        trail_alerted = bool(p.get("trail_alerted", False))
-        partial_done = bool(p.get("partial_tp_done", False))
-
-        # 프리-스톱(선제 청산)
-        if pnl_pct_now <= -PRESTOP_PCT:
-            sr = safe_sell_market(t, 1.0)
-            if sr.get("status") == "OK":
-                filled = sr.get("filled", qty)
-                avg_sell = sr.get("avg_sell") or price
-                pnl_pct = ((avg_sell-avg)/avg)*100.0
-                _after_close(t, p, filled, avg_sell, pnl_pct, label="PRE-STOP")
-                continue
+        st = _strategy_for(p); P = getattr(st, "P", LIVE_PARAMS)
+        d = st.exit_policy(p, price)
+        highest, trail_active, label = d["highest"], d["trail_active"], d["label"]
+        trail_alerted = bool(p.get("trail_alerted", False)) or d["activated"]
 
         # 트레일 활성화 알림(1회 보장)
-        if (not trail_active) and (pnl_pct_now >= TRAIL_ACTIVATE_PCT):
-            trail_active = True
-            trail_alerted = True
+        if d["activated"]:
             send_telegram(
                 "🛡️ 트레일 활성화\n"
                 f"— 심볼: {t}\n"
-                f"— 현재수익률: {pnl_pct_now:.2f}% (임계 {TRAIL_ACTIVATE_PCT:.2f}%)\n"
+                f"— 현재수익률: {d['pnl_pct']:.2f}% (임계 {P['TRAIL_ACTIVATE_PCT']:.2f}%)\n"
                 f"— 최신 최고가: ₩{highest:,.4f}\n"
-                f"— 라인: 최고가 - {TRAIL_PCT:.2f}%"
+                f"— 라인: 최고가 - {P['TRAIL_PCT']:.2f}%"
             )
 
-        # 비상 하드스톱
-        if pnl_pct_now <= -HARD_STOP_PCT:
-            sr = safe_sell_market(t, 1.0)
-            if sr.get("status") == "OK":
-                filled = sr.get("filled", qty)
-                avg_sell = sr.get("avg_sell") or price
-                pnl_pct = ((avg_sell-avg)/avg)*100.0
-                _after_close(t, p, filled, avg_sell, pnl_pct, label="EMERGENCY_STOP")
-                continue
-
-        # 동적 손절/트레일 라인
-        sl_price = avg*(1 - SL_PCT/100.0)
-        trail_line = highest*(1 - TRAIL_PCT/100.0) if trail_active else sl_price
-        dyn_sl = max(sl_price, trail_line) if trail_active else sl_price
-
-        if price <= dyn_sl and pnl_pct_now < TP_PCT:
-            sr = safe_sell_market(t, 1.0)
-            if sr.get("status") == "OK":
-                filled = sr.get("filled", qty)
-                avg_sell = sr.get("avg_sell") or price
-                pnl_pct = ((avg_sell-avg)/avg)*100.0
-                _after_close(t, p, filled, avg_sell, pnl_pct, label="STOP/TRAIL")
-                continue
-
         # 부분익절 1회
-        if (not partial_done) and (pnl_pct_now >= TP_PCT):
-            sr = safe_sell_market(t, PARTIAL_TP_RATIO)
+        if label == "PARTIAL_TP":
+            with _stage("sell"):
+                sr = safe_sell_market(t, d["portion"], trigger_px=price, t_decision=t_dec)
             if sr.get("status") in ("OK","DUST_CLEAN"):
-                sold = sr.get("filled", qty*PARTIAL_TP_RATIO)
+                sold = sr.get("filled", qty*d["portion"])
                 avg_sell = sr.get("avg_sell") or price
                 pnl_pct = ((avg_sell-avg)/avg)*100.0
                 left = max(0.0, qty - sold)
@@ -627,24 +1221,26 @@ def manage_positions_once():
                 )
                 append_csv({"ts": now_str(),"ticker": t,"side":"PARTIAL_TP","qty": sold,"price": avg_sell,
                             "krw": sold*avg_sell,"fee": sold*avg_sell*FEE_RATE,"pnl_krw": sold*(avg_sell-avg),
-                            "pnl_pct": pnl_pct,"note":"partial@TP"})
+                            "pnl_pct": pnl_pct,"note":"partial@TP",**_trace_cols(sr.get("trace"))})
                 with POS_LOCK:
                     POS[t]["qty"] = left
                     POS[t]["partial_tp_done"] = True
                     POS[t]["highest"] = max(highest, price)
                     POS[t]["trail_active"] = True
                     POS[t]["trail_alerted"] = True
-                save_pos()
+                with _stage("save_pos"):
+                    save_pos()
                 continue
 
-        # 트레일 라인 터치로 잔량 청산
-        if trail_active and price <= highest*(1 - TRAIL_PCT/100.0):
-            sr = safe_sell_market(t, 1.0)
+        # PRE-STOP / EMERGENCY_STOP / STOP/TRAIL / TRAIL → 전량 청산
+        elif label:
+            with _stage("sell"):
+                sr = safe_sell_market(t, 1.0, trigger_px=price, t_decision=t_dec)
             if sr.get("status") == "OK":
                 filled = sr.get("filled", qty)
                 avg_sell = sr.get("avg_sell") or price
                 pnl_pct = ((avg_sell-avg)/avg)*100.0
-                _after_close(t, p, filled, avg_sell, pnl_pct, label="TRAIL")
+                _after_close(t, p, filled, avg_sell, pnl_pct, label=label, trace=sr.get("trace"))
                 continue
 
         # 상태 저장
@@ -654,7 +1250,7 @@ def manage_positions_once():
             POS[t]["trail_alerted"] = trail_alerted
         # save_pos()는 이벤트 시점에서만 호출
 
-def _after_close(ticker, pos, filled, avg_sell, pnl_pct, label):
+def _after_close(ticker, pos, filled, avg_sell, pnl_pct, label, trace=None):
     qty = pos.get("qty",0.0); avg = pos.get("avg",0.0)
     if pnl_pct < 0:
         send_telegram(
@@ -668,7 +1264,7 @@ def _after_close(ticker, pos, filled, avg_sell, pnl_pct, label):
         )
     append_csv({"ts": now_str(),"ticker": ticker,"side": label,"qty": qty,"price": avg_sell,
                 "krw": qty*avg_sell,"fee": qty*avg_sell*FEE_RATE,"pnl_krw": qty*(avg_sell-avg),
-                "pnl_pct": pnl_pct,"note":"close_all"})
+                "pnl_pct": pnl_pct,"note":"close_all",**_trace_cols(trace)})
     with POS_LOCK:
         POS[ticker]["qty"] = 0.0
         POS[ticker]["cooldown_until"] = time.time() + (1800 if pos.get("partial_tp_done") else 5400)
@@ -676,6 +1272,124 @@ def _after_close(ticker, pos, filled, avg_sell, pnl_pct, label):
     save_pos()
     send_telegram(f"⏳ 쿨다운 적용 — {ticker} / {30 if pos.get('partial_tp_done') else 90}분")
 
+# ===================== Shadow profiles =====================
+# 라이브 스캔/매니저가 이미 받아온 캔들·시세만으로 대체 파라미터를 가상 운용 (추가 거래소 요청 없음)
+# - 진입: 라이브 스캔이 캔들을 조회한 종목(보유/쿨다운 제외, 라이브 프리필터 통과) 중 조건 충족 시
+#   결정 시점 티커 스냅샷가로 가상 매수 → 라이브가 스캔하지 않는 사이클(09:00, 슬롯 소진)엔 진입 없음
+# - 청산: 라이브 보유 종목은 매니저 틱 시세, 그 외는 스캔 주기 티커 스냅샷 시세(최대 120초)로 평가
+# - 비교 기준선: 라이브와 같은 파라미터의 control 프로필 (같은 체결/평가 주기 조건)
+# - 청산: 라이브 보유 종목은 매니저 틱 시세, 그 외는 스캔 티커 스냅샷 시세로 평가
+SHADOW_LOCK = threading.Lock()
+SHADOW_HEADER = ["ts","profile","ticker","side","qty","price","krw","pnl_krw","pnl_pct","note"]
+
+def _load_shadow_profiles():
+    if not SHADOW_PROFILES: return []
+    try: profs = json.loads(SHADOW_PROFILES)
+    except Exception as e:
+        print(f"[shadow] SHADOW_PROFILES parse error: {e}"); return []
+    if not isinstance(profs, list):
+        print("[shadow] SHADOW_PROFILES must be a JSON list"); return []
+    books = []
+    for i, pr in enumerate(profs):
+        if not isinstance(pr, dict):
+            print(f"[shadow] skipped profile #{i+1}: not an object"); continue
+        unknown = [k for k in pr if k != "name" and k not in LIVE_PARAMS]
+        if unknown: print(f"[shadow] ignored keys: {unknown}")
+        name = str(pr.get("name") or f"shadow{i+1}")
+        try: over = {k: type(LIVE_PARAMS[k])(v) for k, v in pr.items() if k in LIVE_PARAMS}
+        except (TypeError, ValueError) as e:
+            print(f"[shadow] skipped {name}: {e}"); continue
+        if any(bk["name"] == name for bk in books):
+            print(f"[shadow] skipped {name}: duplicate name"); continue
+        books.append({"name": name, "P": {**LIVE_PARAMS, **over}, "pos": {}, "cooldown": {}})
+    if books and not any(bk["name"] == "control" for bk in books):
+        # 라이브 파라미터 그대로인 기준선 — 섀도와 같은 가상 체결/평가 주기 조건
+        books.insert(0, {"name": "control", "P": dict(LIVE_PARAMS), "pos": {}, "cooldown": {}})
+    return books
+
+SHADOW_BOOKS = _load_shadow_profiles()
+
+def _save_shadow():
+    with SHADOW_LOCK:
+        obj = {b["name"]: {"pos": b["pos"], "cooldown": b["cooldown"]} for b in SHADOW_BOOKS}
+    tmp = SHADOW_POS_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f: json.dump(obj, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, SHADOW_POS_FILE)
+
+def _load_shadow():
+    if not SHADOW_BOOKS or not os.path.exists(SHADOW_POS_FILE): return
+    try:
+        with open(SHADOW_POS_FILE, "r", encoding="utf-8") as f: obj = json.load(f)
+    except Exception:
+        return
+    with SHADOW_LOCK:
+        for b in SHADOW_BOOKS:
+            st = obj.get(b["name"]) or {}
+            b["pos"] = st.get("pos", {}); b["cooldown"] = st.get("cooldown", {})
+
+def _shadow_append(row: dict):
+    exists = os.path.exists(SHADOW_CSV_FILE)
+    with open(SHADOW_CSV_FILE, "a", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=SHADOW_HEADER)
+        if not exists: w.writeheader()
+        w.writerow(row)
+
+def _shadow_entries(feed):
+    # feed: [(market, indicators, lows, turnover24h, snapshot_px)] — 라이브 스캔에서 계산된 값 재사용
+    now_ep = time.time(); rows = []
+    with SHADOW_LOCK:
+        for b in SHADOW_BOOKS:
+            P = b["P"]
+            slots = int(P["MAX_OPEN_POSITIONS"]) - len(b["pos"])
+            if slots <= 0: continue
+            cands = []
+            for (t, ind, lows, turnover, px) in feed:
+                if t in b["pos"] or b["cooldown"].get(t, 0.0) > now_ep: continue
+                if len(lows) < int(P["LOOKBACK_MIN"])+5: continue
+                rsi_ok, ema_ok, rebound_ok, vol_ok, score = _entry_eval(ind, lows, P)
+                if rsi_ok and ema_ok and rebound_ok and vol_ok:
+                    cands.append((t, score, px, turnover))
+            cands.sort(key=lambda x: (x[1], x[3]), reverse=True)
+            for (t, _, px, __) in cands[:slots]:
+                avg = px*(1+FEE_RATE); qty = SHADOW_ENTRY_KRW/avg
+                b["pos"][t] = {"qty": qty, "avg": avg, "entry_ts": now_str(), "highest": avg,
+                               "trail_active": False, "partial_tp_done": False}
+                rows.append({"ts": now_str(),"profile": b["name"],"ticker": t,"side":"BUY","qty": qty,
+                             "price": avg,"krw": -SHADOW_ENTRY_KRW,"pnl_krw": 0,"pnl_pct": 0,"note":"shadow_entry"})
+    for r in rows: _shadow_append(r)
+    if rows: _save_shadow()
+
+def _shadow_mark(t, price):
+    rows = []
+    with SHADOW_LOCK:
+        for b in SHADOW_BOOKS:
+            p = b["pos"].get(t)
+            if not p: continue
+            d = _exit_decide(p, price, b["P"])
+            p["highest"] = d["highest"]; p["trail_active"] = d["trail_active"]
+            if not d["label"]: continue
+            px = price*(1-FEE_RATE)
+            sold = p["qty"]*d["portion"]
+            pnl_pct = (px-p["avg"])/p["avg"]*100.0
+            rows.append({"ts": now_str(),"profile": b["name"],"ticker": t,"side": d["label"],"qty": sold,
+                         "price": px,"krw": sold*px,"pnl_krw": sold*(px-p["avg"]),"pnl_pct": pnl_pct,
+                         "note": "partial@TP" if d["label"] == "PARTIAL_TP" else "close_all"})
+            if d["label"] == "PARTIAL_TP":
+                p["qty"] -= sold; p["partial_tp_done"] = True; p["trail_active"] = True
+            else:
+                b["cooldown"][t] = time.time() + (1800 if p.get("partial_tp_done") else 5400)
+                del b["pos"][t]
+    for r in rows: _shadow_append(r)
+    if rows: _save_shadow()
+
+def _shadow_mark_quotes(max_age=120.0):
+    with SHADOW_LOCK:
+        held = {t for b in SHADOW_BOOKS for t in b["pos"]}
+    now_ep = time.time()
+    for t in held:
+        q = QUOTES.get(t)
+        if q and now_ep - q[1] <= max_age: _shadow_mark(t, q[0])
+
 # ===================== Reporter & Dust Cleaner =====================
 def tz_now():
     try:
@@ -689,16 +1403,86 @@ def _read_csv():
     with open(CSV_FILE, newline="", encoding="utf-8") as f:
         return list(csv.DictReader(f))
 
-def build_daily_report_and_clean_dust():
-    now = tz_now()
+def _latency_summary(rows):
+    # 라벨(side)별 주문 수명주기 지연(ms)/슬리피지(bps) p50/p95/p99
+    spans = {"decision_to_submit": ("t_decision","t_submit"), "submit_to_ack": ("t_submit","t_ack"),
+             "ack_to_fill": ("t_ack","t_fill"), "decision_to_fill": ("t_decision","t_fill")}
+    f = lambda v: float(v) if v not in (None, "") else None
+    by = {}
+    for r in rows:
+        d = by.setdefault(r.get("side",""), {k: [] for k in list(spans)+["slip_bps","retries"]})
+        for k, (a, b) in spans.items():
+            ta, tb = f(r.get(a)), f(r.get(b))
+            if ta is not None and tb is not None: d[k].append((tb-ta)*1000.0)
+        if f(r.get("slip_bps")) is not None: d["slip_bps"].append(f(r["slip_bps"]))
+        d["retries"].append(f(r.get("retries")) or 0.0)
+    out = {}
+    for label, d in by.items():
+        o = {"n": len(d["retries"]), "retries_max": max(d["retries"], default=0)}
+        for k in list(spans)+["slip_bps"]:
+            o[k] = {"p50": _pct(d[k], 50), "p95": _pct(d[k], 95), "p99": _pct(d[k], 99)}
+        out[label] = o
+    return out
+
+def _close_stats(rows, s, e):
+    # 청산(매수 제외) 행 기준 비교 지표: 건수/승률/평균손익률/실현손익
+    n = wins = 0; pct_sum = krw_sum = 0.0
+    for r in rows:
+        if r.get("side","") in ("", "BUY"): continue
+        try: dt = datetime.fromisoformat(r.get("ts","").replace(" ","T")).replace(tzinfo=KST)
+        except Exception: continue
+        if not (s <= dt <= e): continue
+        pct = float(r.get("pnl_pct") or 0.0)
+        n += 1; wins += pct > 0; pct_sum += pct; krw_sum += float(r.get("pnl_krw") or 0.0)
+    return {"n": n, "winrate": (wins/n*100.0) if n else 0.0, "avg_pct": (pct_sum/n) if n else 0.0,
+            "pct_sum": pct_sum, "krw": krw_sum}
+
+def _shadow_report(rows, s, e):
+    if not SHADOW_BOOKS: return ""
+    shadow_rows = []
+    if os.path.exists(SHADOW_CSV_FILE):
+        with open(SHADOW_CSV_FILE, newline="", encoding="utf-8") as f: shadow_rows = list(csv.DictReader(f))
+    fmt = lambda name, st: (f"• {name}: 청산 {st['n']} | 승률 {st['winrate']:.1f}% | "
+                            f"평균 {st['avg_pct']:.2f}% | 합계 {st['pct_sum']:.2f}% | ₩{st['krw']:,.0f}")
+    lines = [fmt("live", _close_stats(rows, s, e))]
+    with SHADOW_LOCK:
+        held = {b["name"]: len(b["pos"]) for b in SHADOW_BOOKS}
+    for b in SHADOW_BOOKS:
+        st = _close_stats([r for r in shadow_rows if r.get("profile") == b["name"]], s, e)
+        lines.append(fmt(b["name"], st) + f" | 보유 {held[b['name']]}")
+    return ("\n\n🧪 섀도 비교 (가상 체결 · 진입=라이브 스캔 종목 · 청산=스캔 주기 시세)\n" + "\n".join(lines)
+            + "\n※ 섀도 프로필은 live가 아닌 control(라이브 파라미터, 같은 가상 조건)과 비교")
+
+def _report_window(now):
     today_9 = now.replace(hour=9, minute=0, second=0, microsecond=0)
     if now >= today_9:
         start = today_9 - timedelta(days=1); end = today_9 - timedelta(microseconds=1)
     else:
         start = today_9 - timedelta(days=2); end = today_9 - timedelta(days=1, microseconds=1)
+    return start.replace(tzinfo=KST), end.replace(tzinfo=KST)
+
+def take_balance_snapshot():
+    # 잔고 1회 + 보유 종목 시세 일괄 1회(티커 배치) — 리포트/Dust 청소 공용
+    krw = 0.0; coins = {}
+    try: bals = UPBIT.get_balances() or []
+    except Exception as e:
+        # 잔고 목록 실패 → 코인 없이 현금만으로 리포트 (Dust 청소는 대상 없음)
+        print(f"[report] get_balances failed: {e}")
+        bals = []; krw = get_balance_krw()
+    for b in bals:
+        cur = b.get("currency"); qty = float(b.get("balance") or 0.0)
+        if not cur: continue
+        if cur == "KRW": krw = qty; continue
+        if qty <= 0: continue
+        coins["KRW-"+cur.upper()] = {"qty": qty, "avg": float(b.get("avg_buy_price") or 0.0)}
+    with POS_LOCK:
+        markets = sorted(set(coins) | {t for t, p in POS.items() if p.get("qty",0.0) > 0})
+    return {"ts": time.time(), "krw": krw, "coins": coins, "prices": fetch_quotes(markets)}
 
+def build_daily_report(snap):
+    now = tz_now()
     rows = _read_csv()
-    s = start.replace(tzinfo=KST); e = end.replace(tzinfo=KST)
+    s, e = _report_window(now)
     realized = 0.0; cnt=wins=losses=0; pnl_pct_sum=0.0
     for r in rows:
         ts = r.get("ts","")
@@ -714,83 +1498,137 @@ def build_daily_report_and_clean_dust():
     avg_pct = (pnl_pct_sum/cnt) if cnt else 0.0
     winrate = (wins/cnt*100.0) if cnt else 0.0
 
-    # Dust 청소
-    try:
-        bals = UPBIT.get_balances()
-        cleaned = 0
-        for b in bals or []:
-            cur = b.get("currency")
-            if not cur or cur=="KRW": continue
-            qty = float(b.get("balance") or 0.0)
-            avg = float(b.get("avg_buy_price") or 0.0)
-            if qty<=0: continue
-            est = qty*(avg or 0.0)
-            market = "KRW-"+cur.upper()
-            if est < DUST_LIMIT_KRW:
-                try: UPBIT.sell_market_order(market, qty)
-                except Exception: pass
-                with POS_LOCK:
-                    if market in POS: POS[market]["qty"] = 0.0
-                cleaned += 1
-        if cleaned>0:
-            save_pos()
-            send_telegram(f"🧹 Dust 청산/제거 {cleaned}건 완료 (limit ₩{int(DUST_LIMIT_KRW)})")
-    except Exception as e:
-        send_telegram(f"⚠️ Dust 청산 중 오류: {e}")
-
     with POS_LOCK:
-        holdings = [(t,p) for t,p in POS.items() if p.get("qty",0.0)>0]
+        holdings = [(t,p.copy()) for t,p in POS.items() if p.get("qty",0.0)>0]
     lines=[]; total_val=0.0
     for t,p in holdings:
-        pr = get_price_safe(t) or 0.0
+        pr = snap["prices"].get(t) or 0.0
         if p["qty"]*pr < DUST_LIMIT_KRW:  # dust 숨김
             continue
         total_val += p["qty"]*pr
         lines.append(f"• {t} qty {p['qty']:.6f} @avg {p['avg']:.4f} / now {pr:.4f}")
-    krw = get_balance_krw(); total_assets = krw + total_val
+    krw = snap["krw"]; total_assets = krw + total_val
 
     return (
         f"📊 [일일 리포트] {now.strftime('%Y-%m-%d %H:%M')} ({REPORT_TZ})\n"
         f"거래수 {cnt} (승 {wins}/패 {losses} | 승률 {winrate:.1f}%) | 평균손익률 {avg_pct:.2f}%\n\n"
         f"🔹 보유자산\n" + ("\n".join(lines) if lines else "• (없음)") + "\n\n"
         f"💼 보유금액(코인) ₩{total_val:,.0f} | 현금 ₩{krw:,.0f} | 총자산 ₩{total_assets:,.0f}"
+        + _shadow_report(rows, s, e)
     )
 
+def _sell_dust(market, qty):
+    try:
+        _order_slot(); UPBIT.sell_market_order(market, qty)
+        _last_order_at[market.split("-")[1].upper()] = time.time()
+        return True
+    except Exception as e:
+        print(f"[dust:{market}] {e}"); return False
+
+def sweep_dust(snap):
+    # 스냅샷 시세 기준 Dust 판정 → 주문은 공용 주문 레이트리밋(_order_slot) 아래 병렬 제출
+    dust = []
+    for m, c in snap["coins"].items():
+        px = snap["prices"].get(m) or c["avg"]
+        if c["qty"]*(px or 0.0) < DUST_LIMIT_KRW: dust.append((m, c["qty"]))
+    if not dust: return 0
+    with ThreadPoolExecutor(max_workers=DUST_WORKERS) as ex:
+        list(ex.map(lambda mq: _sell_dust(*mq), dust))
+    with POS_LOCK:
+        for m, _ in dust:
+            if m in POS: POS[m]["qty"] = 0.0
+    save_pos(prices=snap["prices"])
+    send_telegram(f"🧹 Dust 청산/제거 {len(dust)}건 완료 (limit ₩{int(DUST_LIMIT_KRW)})")
+    return len(dust)
+
 def reporter_loop():
+    # REPORT_PREP_SEC 전에 잔고/시세 스냅샷을 미리 받아두고, 정시에 로컬 계산만으로 발송 → Dust 청소는 발송 후
     send_telegram("⏰ 리포터 시작")
+    snap = None; sent = None   # sent: 메모리상 발송일 (REPORT_SENT_FILE 쓰기 실패 시 재발송 방지)
     while True:
         try:
             now = tz_now()
-            sched = now.replace(hour=REPORT_HOUR, minute=REPORT_MINUTE, second=15, microsecond=0)
+            sched = now.replace(hour=REPORT_HOUR, minute=REPORT_MINUTE, second=0, microsecond=0)
             last = None
             try:
                 with open(REPORT_SENT_FILE,"r",encoding="utf-8") as f: last = f.read().strip()
             except Exception: pass
             today = now.date().isoformat()
-            if now >= sched and last != today:
-                msg = build_daily_report_and_clean_dust()
-                send_telegram(msg)
-                try:
-                    with open(REPORT_SENT_FILE,"w",encoding="utf-8") as f: f.write(today)
-                except Exception: pass
-                time.sleep(90)
-            time.sleep(30)
+            prep_at = sched - timedelta(seconds=REPORT_PREP_SEC)
+            if today in (last, sent) or now < prep_at:
+                snap = None
+                wait = (prep_at - now).total_seconds() if now < prep_at else 30
+                time.sleep(max(1.0, min(30.0, wait)))
+                continue
+            if snap is None:
+                snap = take_balance_snapshot()
+            wait = (sched - tz_now()).total_seconds()
+            if wait > 0: time.sleep(wait)
+            send_telegram(build_daily_report(snap))
+            sent = today
+            try:
+                with open(REPORT_SENT_FILE,"w",encoding="utf-8") as f: f.write(today)
+            except Exception: pass
+            try: sweep_dust(snap)
+            except Exception as e: send_telegram(f"⚠️ Dust 청산 중 오류: {e}")
+            snap = None
         except Exception:
             print(f"[reporter] {traceback.format_exc()}"); time.sleep(5)
 
 # ===================== Loops =====================
+# ---- 1분봉 마감 정렬 스케줄러 ----
+# 목표시각 = 분 경계 + SCAN_CLOSE_OFFSET_SEC (epoch 분 경계 = KST 분 경계)
+# 429 백오프로 scan_interval이 60초를 넘으면 stride(분)만큼 사이클을 건너뜀
+# 스캔이 다음 목표를 넘기면 밀린 사이클은 몰아서 돌지 않고 skip 처리
+def _scan_stride() -> int:
+    return max(1, math.ceil(BACKOFF["scan_interval"]/60.0))
+
+def _next_scan_target(now: float, stride: int) -> float:
+    m = math.floor((now - SCAN_CLOSE_OFFSET_SEC)/60.0) + 1
+    m += (-m) % stride
+    return m*60.0 + SCAN_CLOSE_OFFSET_SEC
+
+def _advance_scan_target(prev: float, now: float):
+    stride = _scan_stride(); SCHED["stride_min"] = stride
+    nxt = _next_scan_target(prev, stride); skipped = 0
+    while nxt <= now:
+        nxt = _next_scan_target(nxt, stride); skipped += 1
+    return nxt, skipped
+
+def _closed_only(df):
+    # pyupbit 인덱스 = 캔들 시작시각(KST naive) → 현재 형성 중인 봉 제외
+    cur = now_kst().replace(second=0, microsecond=0, tzinfo=None)
+    return df[df.index < cur]
+
 def scanner_loop():
-    send_telegram(f"🔎 스캐너 시작 (TOPN={BACKOFF['topn']})")
+    send_telegram(f"🔎 스캐너 시작 (TOPN={BACKOFF['topn']}, align={SCAN_ALIGN}"
+                  + (f" +{SCAN_CLOSE_OFFSET_SEC:g}s)" if SCAN_ALIGN == "candle" else ")"))
+    target = _next_scan_target(time.time(), _scan_stride())
     while True:
-        try: scan_once_and_maybe_buy()
+        if SCAN_ALIGN == "candle":
+            wait = target - time.time()
+            if wait > 0: time.sleep(wait)
+            lag_ms = max(0.0, (time.time() - target)*1000.0)
+            SCHED["cycles"] += 1; SCHED["last_lag_ms"] = lag_ms
+            SCHED["max_lag_ms"] = max(SCHED["max_lag_ms"], lag_ms)
+        try:
+            with _cycle("scan") as tm:
+                if tm is not None and SCAN_ALIGN == "candle":
+                    tm.meta["lag_ms"] = round(lag_ms, 1); tm.meta["stride_min"] = SCHED["stride_min"]
+                scan_once_and_maybe_buy()
         except Exception:
             print(f"[scanner] {traceback.format_exc()}")
-        time.sleep(BACKOFF["scan_interval"])
+        if SCAN_ALIGN == "candle":
+            target, skipped = _advance_scan_target(target, time.time())
+            if skipped: SCHED["skipped"] += skipped
+        else:
+            time.sleep(BACKOFF["scan_interval"])
 
 def manager_loop():
     send_telegram("🧭 매니저 시작 (SL/Partial/Trailing)")
     while True:
-        try: manage_positions_once()
+        try:
+            with _cycle("manager"): manage_positions_once()
         except Exception:
             print(f"[manager] {traceback.format_exc()}")
         time.sleep(max(0.1, float(os.getenv("MANAGER_TICK_MS","150"))/1000.0))
@@ -809,6 +1647,9 @@ def init_bot():
     except Exception as e:
         print(f"[diag] {e}")
     load_pos()
+    try: _migrate_csv_header()
+    except Exception as e: print(f"[csv] header migration failed: {e}")
+    _load_shadow()
     send_telegram("🤖 봇 시작됨")
     send_telegram(
         f"⚙️ thresholds | RSI≤{RSI_MAX_BOTTOM} | EMA±{EMA_NEAR_PCT}% | "
@@ -816,11 +1657,15 @@ def init_bot():
         f"SL={SL_PCT}% | TP@{TP_PCT}%/50% | Trail act {TRAIL_ACTIVATE_PCT}% line {TRAIL_PCT}% | "
         f"HardStop {HARD_STOP_PCT}% | PreStop {PRESTOP_PCT}% | Dust<₩{int(DUST_LIMIT_KRW)} | TOPN={BACKOFF['topn']}"
     )
+    if SHADOW_BOOKS:
+        send_telegram("🧪 섀도 프로필: " + " | ".join(
+            b["name"] + " " + ",".join(f"{k}={v}" for k, v in b["P"].items() if v != LIVE_PARAMS[k])
+            for b in SHADOW_BOOKS))
 
 def start_threads():
-    threading.Thread(target=scanner_loop, daemon=True).start()
-    threading.Thread(target=manager_loop, daemon=True).start()
-    threading.Thread(target=reporter_loop, daemon=True).start()
+    threading.Thread(target=scanner_loop, name="scanner", daemon=True).start()
+    threading.Thread(target=manager_loop, name="manager", daemon=True).start()
+    threading.Thread(target=reporter_loop, name="reporter", daemon=True).start()
 
 # import-time autostart (gunicorn)
 if not getattr(app, "_bot_started", False):